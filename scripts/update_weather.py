@@ -11,9 +11,42 @@ Key changes from v1:
 """
 
 import json
+import math
+import os
 import re
-import requests
-from datetime import datetime, timedelta
+import time
+import numpy as np
+import orjson
+import requests_cache
+from datetime import timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# HTTP cache persisted between workflow runs (see actions/cache in the workflow).
+# cache_control=True honours the API's caching headers and revalidates stale
+# entries with If-None-Match / If-Modified-Since, so an unchanged forecast
+# comes back as a 304 and the stored body is reused.
+SESSION = requests_cache.CachedSession(
+    "openmeteo_cache",
+    cache_control=True,
+    expire_after=timedelta(hours=1),
+)
+# One pooled keep-alive connection set, shared by every request in the run.
+# Transient rate-limit/server errors are retried with backoff instead of
+# failing the run and leaving the map stale until the next cron slot.
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    ),
+)
 
 # City coordinates for Open-Meteo API
 CITIES = {
@@ -37,32 +70,73 @@ TARGET_DATES = [
 
 DAY_KEYS = ["jan3", "jan4", "jan5", "jan6", "jan7", "jan8", "jan9", "jan10"]
 
+# Marker comments delimiting the auto-generated block in index.html
+WEATHER_START_MARKER = "// WEATHER_DATA_START\n"
+WEATHER_END_MARKER = "// WEATHER_DATA_END"
 
-def fetch_hourly_weather(city_key: str) -> dict:
-    """Fetch HOURLY weather data for a city from Open-Meteo API."""
-    city = CITIES[city_key]
+# "last updated" footer in index.html, compiled once at import
+TIMESTAMP_RE = re.compile(r'Données météo mises à jour.*?\|')
 
+# One city entry inside a day of the generated weatherData literal
+CITY_JS_TEMPLATE = (
+    "                {city_key}: {{ "
+    "hourly: {hourly}, "
+    "overnightLow: {overnight}, "
+    "dailyHigh: {high}, dailyLow: {low}, "
+    "snow: {snow}, precip: {precip} }}"
+)
+
+
+def fetch_all_hourly_weather() -> list:
+    """
+    Fetch HOURLY weather data for every city in one Open-Meteo request.
+
+    The API accepts comma-separated coordinate lists and answers with one
+    result per location, in the same order as CITIES.
+    """
     url = "https://api.open-meteo.com/v1/forecast"
     params = {
-        "latitude": city["lat"],
-        "longitude": city["lon"],
-        "hourly": "temperature_2m,precipitation,snowfall",
+        "latitude": ",".join(str(city["lat"]) for city in CITIES.values()),
+        "longitude": ",".join(str(city["lon"]) for city in CITIES.values()),
+        "hourly": "temperature_2m",  # Only temps are used hourly; totals come from daily
         "daily": "precipitation_sum,snowfall_sum",  # Keep daily totals for snow/precip
         "timezone": "Europe/Paris",  # Critical: always use Paris timezone
         "start_date": TARGET_DATES[0],
         "end_date": TARGET_DATES[-1],
     }
 
-    response = requests.get(url, params=params, timeout=30)
+    response = SESSION.get(url, params=params, timeout=30)
     response.raise_for_status()
-    return response.json()
+    # orjson parses the float-heavy hourly arrays noticeably faster than stdlib json
+    return orjson.loads(response.content)
+
+
+def reduce_days(temps: np.ndarray) -> tuple:
+    """
+    Reduce a (days, 24) temperature array to per-day stats in one pass per stat.
+
+    Returns (daily_high, daily_low, overnight_low) arrays of length days.
+    fmax/fmin skip NaN hours; a day with no data at all reduces to NaN.
+    """
+    daily_high = np.fmax.reduce(temps, axis=1)
+    daily_low = np.fmin.reduce(temps, axis=1)
+    # Overnight low: minimum temp from midnight to 6am (hours 0-5)
+    overnight_low = np.fmin.reduce(temps[:, 0:6], axis=1)
+    return daily_high, daily_low, overnight_low
+
+
+def nan_to_none(values: np.ndarray) -> list:
+    """Convert an array to a list, with missing (NaN) values as None."""
+    return [None if math.isnan(v) else v for v in values.tolist()]
 
 
-def extract_day_data(hourly_data: dict, daily_data: dict, day_index: int) -> dict:
+def extract_days(temps: np.ndarray, daily_data: dict) -> list:
     """
-    Extract data for a single day from the hourly API response.
+    Extract per-day data from a city's (days, 24) hourly temperature array.
 
-    Returns:
+    Missing hours are NaN in the array and become None in the result.
+
+    Returns one dict per day:
         {
             "hourly": [temp_00, temp_01, ..., temp_23],  # 24 hourly temps
             "overnightLow": float,  # Min temp from 00:00-06:00 (for regel warning)
@@ -72,39 +146,30 @@ def extract_day_data(hourly_data: dict, daily_data: dict, day_index: int) -> dic
             "precip": float         # Daily precipitation total
         }
     """
-    # Hourly data is indexed: day 0 = hours 0-23, day 1 = hours 24-47, etc.
-    start_hour = day_index * 24
-    end_hour = start_hour + 24
+    # Round all temps to 1 decimal
+    temps = np.round(temps, 1)
 
-    hourly_temps = hourly_data["temperature_2m"][start_hour:end_hour]
+    daily_high, daily_low, overnight_low = (nan_to_none(a) for a in reduce_days(temps))
 
-    # Round all temps to 1 decimal
-    hourly_temps = [round(t, 1) if t is not None else None for t in hourly_temps]
+    days = []
+    for day_index, day_temps in enumerate(temps):
+        # Snow and precipitation from daily data
+        snow = daily_data["snowfall_sum"][day_index]
+        snow = round(snow, 1) if snow is not None else 0
 
-    # Overnight low: minimum temp from midnight to 6am (hours 0-5)
-    overnight_temps = hourly_temps[0:6]
-    overnight_low = min([t for t in overnight_temps if t is not None], default=None)
-
-    # Daily high/low for display
-    valid_temps = [t for t in hourly_temps if t is not None]
-    daily_high = max(valid_temps) if valid_temps else None
-    daily_low = min(valid_temps) if valid_temps else None
-
-    # Snow and precipitation from daily data
-    snow = daily_data["snowfall_sum"][day_index]
-    snow = round(snow, 1) if snow is not None else 0
-
-    precip = daily_data["precipitation_sum"][day_index]
-    precip = round(precip, 1) if precip is not None else 0
-
-    return {
-        "hourly": hourly_temps,
-        "overnightLow": overnight_low,
-        "dailyHigh": daily_high,
-        "dailyLow": daily_low,
-        "snow": snow,
-        "precip": precip
-    }
+        precip = daily_data["precipitation_sum"][day_index]
+        precip = round(precip, 1) if precip is not None else 0
+
+        days.append({
+            "hourly": nan_to_none(day_temps),
+            "overnightLow": overnight_low[day_index],
+            "dailyHigh": daily_high[day_index],
+            "dailyLow": daily_low[day_index],
+            "snow": snow,
+            "precip": precip
+        })
+
+    return days
 
 
 def build_weather_data() -> dict:
@@ -114,87 +179,138 @@ def build_weather_data() -> dict:
     for day_key in DAY_KEYS:
         weather_data[day_key] = {}
 
-    for city_key in CITIES:
-        print(f"Fetching hourly weather for {city_key}...")
-        try:
-            data = fetch_hourly_weather(city_key)
-            hourly = data["hourly"]
-            daily = data["daily"]
+    print(f"Fetching hourly weather for {len(CITIES)} cities...")
+    try:
+        results = fetch_all_hourly_weather()
+    except Exception as e:
+        print(f"Error fetching weather: {e}")
+        return weather_data
 
-            for i, date in enumerate(TARGET_DATES):
-                day_key = DAY_KEYS[i]
-                day_data = extract_day_data(hourly, daily, i)
-                weather_data[day_key][city_key] = day_data
+    for city_key, data in zip(CITIES, results):
+        # Hourly data is indexed: day 0 = hours 0-23, day 1 = hours 24-47, etc.
+        # Convert once per city (None -> NaN) and view it as one row per day.
+        temps = np.array(data["hourly"]["temperature_2m"], dtype=np.float64)
+        temps = temps.reshape(len(TARGET_DATES), 24)
 
-        except Exception as e:
-            print(f"Error fetching {city_key}: {e}")
-            continue
+        for day_key, day_data in zip(DAY_KEYS, extract_days(temps, data["daily"])):
+            weather_data[day_key][city_key] = day_data
 
     return weather_data
 
 
 def format_hourly_array(temps: list) -> str:
     """Format hourly temps array as compact JavaScript."""
-    # Replace None with null for JavaScript
-    formatted = [str(t) if t is not None else "null" for t in temps]
-    return "[" + ",".join(formatted) + "]"
+    # JSON arrays are valid JavaScript, and json.dumps already writes None as null
+    return json.dumps(temps, separators=(",", ":"))
 
 
-def format_weather_js(weather_data: dict) -> str:
-    """Format weather data as JavaScript object literal with hourly data."""
-    lines = ["        const weatherData = {"]
+def js_number(value) -> str:
+    """Format an optional number as a JavaScript literal."""
+    return "null" if value is None else str(value)
+
+
+def build_weather_js_template() -> str:
+    """
+    Build the whole weatherData literal once, with a positional {} slot for
+    every dynamic value.
+
+    DAY_KEYS and CITIES are fixed, so only the numbers change between runs.
+    Slots are filled day by day, city by city in CITIES order, six per city:
+    hourly, overnightLow, dailyHigh, dailyLow, snow, precip.
+    """
+    slot = "\0"  # Stands in for each value until literal braces are escaped
+    parts = ["        const weatherData = {"]
 
     for day_key in DAY_KEYS:
-        lines.append(f'            "{day_key}": {{')
-
-        city_lines = []
-        for city_key, data in weather_data[day_key].items():
-            hourly_str = format_hourly_array(data["hourly"])
-            overnight = data["overnightLow"] if data["overnightLow"] is not None else "null"
-            high = data["dailyHigh"] if data["dailyHigh"] is not None else "null"
-            low = data["dailyLow"] if data["dailyLow"] is not None else "null"
-
-            city_line = (
-                f'                {city_key}: {{ '
-                f'hourly: {hourly_str}, '
-                f'overnightLow: {overnight}, '
-                f'dailyHigh: {high}, dailyLow: {low}, '
-                f'snow: {data["snow"]}, precip: {data["precip"]} }}'
+        city_lines = [
+            CITY_JS_TEMPLATE.format(
+                city_key=city_key,
+                hourly=slot,
+                overnight=slot,
+                high=slot,
+                low=slot,
+                snow=slot,
+                precip=slot,
             )
-            city_lines.append(city_line)
+            for city_key in CITIES
+        ]
+        parts.extend([
+            f'            "{day_key}": {{',
+            ",\n".join(city_lines),
+            "            },",
+        ])
+
+    parts.append("        };")
+    skeleton = "\n".join(parts)
+    return skeleton.replace("{", "{{").replace("}", "}}").replace(slot, "{}")
+
 
-        lines.append(",\n".join(city_lines))
-        lines.append("            },")
+WEATHER_JS_TEMPLATE = build_weather_js_template()
 
-    lines.append("        };")
-    return "\n".join(lines)
 
+def format_weather_js(weather_data: dict) -> str:
+    """
+    Format weather data as JavaScript object literal with hourly data.
 
-def update_html(weather_data: dict):
-    """Update the weatherData in index.html."""
+    Expects every city in CITIES for every day in DAY_KEYS.
+    """
+    values = []
+    for day_key in DAY_KEYS:
+        for city_key in CITIES:
+            data = weather_data[day_key][city_key]
+            values.extend((
+                format_hourly_array(data["hourly"]),
+                js_number(data["overnightLow"]),
+                js_number(data["dailyHigh"]),
+                js_number(data["dailyLow"]),
+                data["snow"],
+                data["precip"],
+            ))
+
+    return WEATHER_JS_TEMPLATE.format(*values)
+
+
+def update_html(weather_data: dict) -> bool:
+    """
+    Update the weatherData in index.html.
+
+    Returns False, leaving the file (and its timestamp) untouched, when the
+    forecast is identical to what the page already embeds.
+    """
     with open("index.html", "r", encoding="utf-8") as f:
         html = f.read()
 
-    # Pattern to match the weatherData block between markers
-    pattern = r'(// WEATHER_DATA_START\n)(.*?)(// WEATHER_DATA_END)'
+    # The weatherData block sits between two fixed marker comments, so a plain
+    # substring search is enough to find it - no regex scan over the whole file
+    start = html.index(WEATHER_START_MARKER) + len(WEATHER_START_MARKER)
+    end = html.index(WEATHER_END_MARKER, start)
 
-    new_weather_js = format_weather_js(weather_data)
-    replacement = f"// WEATHER_DATA_START\n{new_weather_js}\n        // WEATHER_DATA_END"
+    new_block = format_weather_js(weather_data) + "\n        "
 
-    new_html = re.sub(pattern, replacement, html, flags=re.DOTALL)
+    # Same forecast as last run: skip the write so the workflow has nothing to commit
+    if html[start:end] == new_block:
+        print("Weather data unchanged, index.html left as is")
+        return False
 
     # Update timestamp
-    timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
-    new_html = re.sub(
-        r'Données météo mises à jour.*?\|',
-        f'Données météo mises à jour: {timestamp} |',
-        new_html
-    )
-
-    with open("index.html", "w", encoding="utf-8") as f:
-        f.write(new_html)
+    timestamp = time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime())
+    stamp = f'Données météo mises à jour: {timestamp} |'
+
+    # Stream the untouched head and tail around the new block into a temp file
+    # instead of assembling another full copy of the page. It is flushed to
+    # disk and then atomically renamed over index.html, so a run killed
+    # mid-write never leaves a truncated page behind.
+    tmp_path = "index.html.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(TIMESTAMP_RE.sub(stamp, html[:start]))
+        f.write(new_block)
+        f.write(TIMESTAMP_RE.sub(stamp, html[end:]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, "index.html")
 
     print(f"Updated index.html at {timestamp}")
+    return True
 
 
 def main():
@@ -204,9 +320,11 @@ def main():
 
     weather_data = build_weather_data()
 
-    if weather_data and all(weather_data[day] for day in DAY_KEYS):
-        update_html(weather_data)
-        print("✅ Hourly weather data updated successfully!")
+    if weather_data and all(len(weather_data[day]) == len(CITIES) for day in DAY_KEYS):
+        if update_html(weather_data):
+            print("✅ Hourly weather data updated successfully!")
+        else:
+            print("✅ Hourly weather data already up to date")
     else:
         print("❌ Failed to fetch complete weather data")
         exit(1)